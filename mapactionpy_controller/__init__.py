@@ -2,7 +2,8 @@ import json
 import logging
 from os import path
 
-from jsonschema import validate
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 CONFIG_SCHEMAS_DIR = path.join(path.abspath(path.dirname(__file__)), 'schemas')
 TASK_TEMPLATES_DIR = path.join(path.abspath(path.dirname(__file__)), 'task-templates')
@@ -14,8 +15,17 @@ def _get_validator_for_config_schema(schema_file):
     with open(schema_path) as sf:
         schema = json.load(sf)
 
+    # Check the schema and create the validator once here. `jsonschema.validate` would repeat both of
+    # these steps every time that a config file is validated.
+    validator_cls = validator_for(schema)
+    validator_cls.check_schema(schema)
+    validator = validator_cls(schema)
+
     def validate_against_schema(data):
-        validate(data, schema)
+        # Raises the same error that `jsonschema.validate(data, schema)` would
+        error = best_match(validator.iter_errors(data))
+        if error is not None:
+            raise error
 
     return validate_against_schema
 
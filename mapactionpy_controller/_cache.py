@@ -0,0 +1,49 @@
+"""
+A minimal bounded cache, which is used for the process-wide caches within this package.
+"""
+
+
+class BoundedCache(object):
+    """
+    A dict based cache which holds at most `max_size` items. When it is full, it is emptied before the next
+    item is added. This is cruder than least-recently-used eviction, but it is cheap, and (unlike
+    `functools.lru_cache`) is available in Python 2.7. The keys of each of the caches are drawn from a
+    small set (eg the layers in the layer properties), so in practice they are rarely filled.
+    """
+    __slots__ = ('max_size', '_items')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        if (key not in self._items) and (len(self._items) >= self.max_size):
+            self._items.clear()
+        self._items[key] = value
+
+    def get_or_create(self, key, create):
+        """
+        Returns the cached value for `key`. If there is none, then the value is created by calling
+        `create(key)`, and is cached before it is returned.
+        """
+        try:
+            return self._items[key]
+        except KeyError:
+            value = create(key)
+            self.set(key, value)
+            return value
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
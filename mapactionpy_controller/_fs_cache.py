@@ -0,0 +1,79 @@
+"""
+Process-wide caches of filesystem information.
+
+When several recipes are processed in a single run, the same directories (eg. `cmf.map_templates`) are
+listed once per recipe. The listings are cached here, keyed by the directory's path and modification
+time. Adding, removing or renaming an entry in a directory updates its modification time, so a changed
+directory is automatically re-read.
+"""
+import os
+import time
+
+from mapactionpy_controller._cache import BoundedCache
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2.7
+    from scandir import scandir
+
+
+# Nothing derived from a file or directory which was modified less than this many seconds ago is cached.
+# The timestamp resolution of some filesystems is coarse, so a change made immediately after it was read
+# could otherwise leave the modification time unchanged and the cached value stale.
+_RACY_INTERVAL = 2.0
+
+# {path: (mtime, listing)}, for at most 128 directories at any one time
+_list_dir_cache = BoundedCache(128)
+
+
+def get_mtime(stat_result):
+    """
+    Returns the most precise modification time available from `stat_result`, for use in cache keys.
+    """
+    # `st_mtime_ns` is not available in Python 2.7
+    return getattr(stat_result, 'st_mtime_ns', stat_result.st_mtime)
+
+
+def is_recently_modified(stat_result):
+    """
+    Returns True if the file or directory was modified so recently that a further change might not alter
+    its modification time. Anything derived from its contents should not be cached yet.
+    """
+    return (time.time() - stat_result.st_mtime) <= _RACY_INTERVAL
+
+
+def list_dir_cached(dir_path):
+    """
+    Lists the contents of a directory, reusing the previous listing if the directory has not been modified
+    since.
+
+    @param dir_path: The path of the directory to list.
+    @returns: A tuple of the `DirEntry` objects returned by `scandir`, one for each entry in the directory.
+              `DirEntry` only calls `stat` when `is_file()` or `is_dir()` is first called on it (and only
+              if the filesystem did not report the file type in the listing), and then caches the result.
+              Hence callers which test the name of an entry first avoid the `stat` for most entries.
+    @raises OSError: If `dir_path` does not exist or cannot be listed.
+    """
+    dir_stat = os.stat(dir_path)
+    mtime = get_mtime(dir_stat)
+
+    cached = _list_dir_cache.get(dir_path)
+    if cached and (cached[0] == mtime):
+        return cached[1]
+
+    listing = tuple(scandir(dir_path))
+
+    if not is_recently_modified(dir_stat):
+        _list_dir_cache.set(dir_path, (mtime, listing))
+    else:
+        _list_dir_cache.discard(dir_path)
+
+    return listing
+
+
+def clear_list_dir_cache():
+    """
+    Discards all of the cached directory listings.
+    """
+    _list_dir_cache.clear()
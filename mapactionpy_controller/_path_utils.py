@@ -0,0 +1,24 @@
+"""
+Helpers for testing file names, which are called for every entry in a directory listing.
+"""
+import os
+
+
+def has_extension(name, ext):
+    """
+    Equivalent to `os.path.splitext(name)[1] == ext`, for a file `name` without any directory component.
+
+    For the usual case of an extension such as `.lyr`, `str.endswith` avoids the allocations in
+    `os.path.splitext`.
+
+    @param name: The name of the file.
+    @param ext: The extension, including the leading dot (eg. `.lyr`), or an empty string to match files
+                without any extension.
+    @returns: True if `name` has the extension `ext`.
+    """
+    if ext.startswith('.') and ('.' not in ext[1:]):
+        # `splitext` ignores leading dots. Hence the name must contain something other than dots before the
+        # extension (so `.lyr` and `..lyr` have no extension).
+        return name.endswith(ext) and bool(name[:-len(ext)].lstrip('.'))
+
+    return os.path.splitext(name)[1] == ext
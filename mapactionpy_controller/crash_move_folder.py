@@ -1,38 +1,42 @@
-import json
 import os
 from mapactionpy_controller import _get_validator_for_config_schema
 
+try:
+    # `orjson` is optional. If it is installed, it is used as a faster drop-in for `json.loads`.
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 validate_against_cmf_schema = _get_validator_for_config_schema('cmf-v0.2.schema')
 
 
-class CrashMoveFolder:
+class CrashMoveFolder(object):
+    # 8 directories (alphabetical order just for readability)
+    _DIR_ATTRS = ('active_data', 'data_schemas', 'export_dir', 'layer_rendering', 'legend_images',
+                  'map_projects', 'map_templates', 'original_data')
+    # 6 files (alphabetical order just for readability)
+    _FILE_ATTRS = ('data_nc_definition', 'layer_nc_definition', 'layer_properties', 'map_definitions',
+                   'map_projects_nc_definition', 'map_template_nc_definition')
+
+    # The set of attributes is fixed, so there is no need for a per-instance `__dict__`
+    __slots__ = ('path', 'arcgis_version', '_verified_paths', '_verified') + _DIR_ATTRS + _FILE_ATTRS
+
     def __init__(self, cmf_path, verify_on_creation=True):
 
+        # The result of the last `verify_paths()` call and the path values it was computed for
+        self._verified_paths = None
+        self._verified = None
+
         self.path = os.path.realpath(os.path.expanduser(os.path.dirname(cmf_path)))
 
-        with open(cmf_path, 'r') as f:
-            obj = json.loads(f.read())
-            validate_against_cmf_schema(obj)
-
-            # Doubtless there is a more elegant way to do this.
-            # 8 directories (alphabetical order just for readability)
-            self.active_data = os.path.join(self.path, obj['active_data'])
-            self.data_schemas = os.path.join(self.path, obj['data_schemas'])
-            self.export_dir = os.path.join(self.path, obj['export_dir'])
-            self.layer_rendering = os.path.join(self.path, obj['layer_rendering'])
-            self.legend_images = os.path.join(self.path, obj['legend_images'])
-            self.map_projects = os.path.join(self.path, obj['map_projects'])
-            self.map_templates = os.path.join(self.path, obj['map_templates'])
-            self.original_data = os.path.join(self.path, obj['original_data'])
-            # 6 files (alphabetical order just for readablity)
-            self.data_nc_definition = os.path.join(self.path, obj['data_nc_definition'])
-            self.layer_nc_definition = os.path.join(self.path, obj['layer_nc_definition'])
-            self.layer_properties = os.path.join(self.path, obj['layer_properties'])
-            self.map_definitions = os.path.join(self.path, obj['map_definitions'])
-            self.map_projects_nc_definition = os.path.join(self.path, obj['map_projects_nc_definition'])
-            self.map_template_nc_definition = os.path.join(self.path, obj['map_template_nc_definition'])
-            # others
-            self.arcgis_version = obj['arcgis_version']
+        with open(cmf_path, 'rb') as f:
+            obj = _json_loads(f.read())
+        validate_against_cmf_schema(obj)
+
+        for attr in self._DIR_ATTRS + self._FILE_ATTRS:
+            setattr(self, attr, os.path.join(self.path, obj[attr]))
+        # others
+        self.arcgis_version = obj['arcgis_version']
 
         if verify_on_creation and (not self.verify_paths()):
             failing_paths = [path for path, valid in self._get_path_verification_as_dict().items() if not valid]
@@ -41,28 +45,35 @@ class CrashMoveFolder:
                              "CrashMoveFolder '{}'. The values for these parameters could not be located:\n\t"
                              "{}".format(cmf_path, failing_paths_str))
 
+    def _iter_path_verification(self):
+        """
+        A generator of `(attribute_name, is_valid)` tuples, for each of the directories and files. The
+        checks are done lazily, so a caller which stops at the first invalid path avoids the remaining
+        filesystem access.
+        """
+        for attr in self._DIR_ATTRS:
+            yield attr, os.path.isdir(getattr(self, attr))
+        for attr in self._FILE_ATTRS:
+            yield attr, os.path.exists(getattr(self, attr))
+
     def _get_path_verification_as_dict(self):
-        results = {}
-
-        # 8 dirs (alphabetical order just for readability)
-        results['active_data'] = os.path.isdir(self.active_data)
-        results['data_schemas'] = os.path.isdir(self.data_schemas)
-        results['export_dir'] = os.path.isdir(self.export_dir)
-        results['layer_rendering'] = os.path.isdir(self.layer_rendering)
-        results['legend_images'] = os.path.isdir(self.legend_images)
-        results['map_projects'] = os.path.isdir(self.map_projects)
-        results['map_templates'] = os.path.isdir(self.map_templates)
-        results['original_data'] = os.path.isdir(self.original_data)
-        # 6 files (alphabetical order just for readability)
-        results['data_nc_definition'] = os.path.exists(self.data_nc_definition)
-        results['layer_nc_definition'] = os.path.exists(self.layer_nc_definition)
-        results['layer_properties'] = os.path.exists(self.layer_properties)
-        results['map_definitions'] = os.path.exists(self.map_definitions)
-        results['map_projects_nc_definition'] = os.path.exists(self.map_projects_nc_definition)
-        results['map_template_nc_definition'] = os.path.exists(self.map_template_nc_definition)
-
-        return results
-
-    def verify_paths(self):
-        # return all(all(_verify_paths().values()), self.verify_mxds())
-        return all(self._get_path_verification_as_dict().values())
+        return dict(self._iter_path_verification())
+
+    def verify_paths(self, refresh=False):
+        """
+        Checks that all of the directories and files referenced by the CrashMoveFolder exist.
+
+        The result is cached and reused by subsequent calls, for as long as none of the paths have been
+        changed.
+
+        @param refresh: If True, then the paths are checked again even if there is a cached result. Use this
+                        if files or directories may have been created or removed since the last check.
+        @returns: True if all of the paths exist, otherwise False.
+        """
+        current_paths = tuple(getattr(self, attr) for attr in self._DIR_ATTRS + self._FILE_ATTRS)
+        if refresh or (current_paths != self._verified_paths):
+            # `all()` stops at the first path which cannot be verified
+            self._verified = all(valid for attr, valid in self._iter_path_verification())
+            self._verified_paths = current_paths
+
+        return self._verified
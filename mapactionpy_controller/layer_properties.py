@@ -1,8 +1,14 @@
 import json
-import os
+from mapactionpy_controller._path_utils import has_extension
 from mapactionpy_controller.recipe_layer import RecipeLayer
 from mapactionpy_controller.crash_move_folder import CrashMoveFolder
 
+try:
+    from os import scandir
+except ImportError:
+    # Python 2.7
+    from scandir import scandir
+
 
 class LayerProperties:
     """
@@ -64,12 +70,11 @@ class LayerProperties:
 
     def _get_lyr_rendering_names_as_set(self):
         files_unique = set()
-        dir_content = os.listdir(self.cmf.layer_rendering)
-        for f in dir_content:
-            f_path = os.path.join(self.cmf.layer_rendering, f)
-            filename, fileext = os.path.splitext(f)
-            if (os.path.isfile(f_path)) and (fileext == self.extension):
-                files_unique.add(filename)
+        # A single directory read. Each entry already knows whether it is a file, so there is no
+        # need to `stat` each file individually.
+        for entry in scandir(self.cmf.layer_rendering):
+            if has_extension(entry.name, self.extension) and entry.is_file():
+                files_unique.add(entry.name[:len(entry.name) - len(self.extension)])
 
         return files_unique
 
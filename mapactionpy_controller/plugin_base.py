@@ -1,32 +1,150 @@
 import errno
-import glob
 import logging
-import math
+from multiprocessing.pool import ThreadPool
 import os
-from operator import itemgetter
 import re
 from shutil import copyfile
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 
 from slugify import slugify
 import mapactionpy_controller.xml_exporter as xml_exporter
+from mapactionpy_controller._cache import BoundedCache
+from mapactionpy_controller._fs_cache import list_dir_cached
+from mapactionpy_controller._path_utils import has_extension
 from mapactionpy_controller.crash_move_folder import CrashMoveFolder
 
 
 logger = logging.getLogger(__name__)
 
+# Matchers for the `recipe.template` regexes, keyed by the pattern. Many recipes share the same template regex.
+_template_matcher_cache = BoundedCache(256)
+# Characters which have a special meaning in a regex. A pattern without any of these is a plain string.
+_REGEX_METACHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+def _create_template_matcher(pattern):
+    if _REGEX_METACHARACTERS.search(pattern):
+        return re.compile(pattern).search
+
+    def matcher(filename):
+        return pattern in filename
+
+    return matcher
+
+
+def _get_template_matcher(pattern):
+    """
+    Returns a function which tests whether a filename matches the `recipe.template` regex `pattern`. The
+    result is equivalent to `re.search(pattern, filename)`, though if `pattern` does not contain any regex
+    metacharacters a plain substring test is used instead of the regex engine.
+
+    @param pattern: The regex, as given in `recipe.template`.
+    @returns: A function which accepts a filename, and returns a truthy value if the filename matches.
+    """
+    return _template_matcher_cache.get_or_create(pattern, _create_template_matcher)
+
+
+# Slugified product names, keyed by the product name. The same products are typically rebuilt many times.
+_slug_cache = BoundedCache(1024)
+
+
+def _slugify_cached(text):
+    return _slug_cache.get_or_create(text, slugify)
+
+
+# The two digit version number within the filename of a map project. `[0-9]` rather than `\d`, which would
+# also match non-ASCII digits in Python 3.
+_TWO_DIGITS_RE = re.compile(r'[0-9][0-9]\Z')
+
+
+def _get_version_str(version_num):
+    """
+    Returns the version string (eg. `v01`) used in the names of both the map project file and the export
+    directory, so that the two are always padded consistently.
+    """
+    return 'v' + str(version_num).zfill(2)
+
+
+# Exported file formats which are already compressed. These are stored in the zip file as-is, as
+# deflating them again costs CPU time for little or no reduction in size.
+_PRECOMPRESSED_EXTENSIONS = frozenset(('.jpeg', '.jpg', '.kmz', '.pdf', '.png', '.zip'))
+
+
+def _get_zip_compress_type(fpath):
+    if os.path.splitext(fpath)[1].lower() in _PRECOMPRESSED_EXTENSIONS:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def _makedirs(dir_path):
+    """
+    Creates `dir_path` and any missing parent directories, unless it already exists. This is equivalent
+    to `os.makedirs(dir_path, exist_ok=True)`, which is not available in Python 2.7.
+    """
+    # The directory usually exists already when a map is re-exported, so check that first
+    if os.path.isdir(dir_path):
+        return
+
+    try:
+        os.makedirs(dir_path)
+    except OSError as exc:
+        # The directory may have been created by another process since the check above.
+        # Note 'errno.EEXIST' is not a typo. There should be two 'E's.
+        # https://docs.python.org/2/library/errno.html#errno.EEXIST
+        if not ((exc.errno == errno.EEXIST) and os.path.isdir(dir_path)):
+            raise
+
+
+def _copy_file(src, dst):
+    """
+    Copies the contents of the file `src` to `dst`.
+
+    Where it is available (Linux, Python 3.8+) `os.copy_file_range` is used, so that the data is copied
+    within the kernel rather than via user space. On copy-on-write filesystems (eg. btrfs, XFS) this may
+    share the underlying blocks rather than copying them at all. Otherwise, or if the filesystem does not
+    support it, this falls back to `shutil.copyfile`.
+
+    @raises shutil.Error: If `src` and `dst` are the same file (as `shutil.copyfile` does).
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    # Opening `dst` truncates it, so if it is the same file as `src` the contents would be lost. Leave that
+    # case to `copyfile`, which raises an error without touching the file.
+    if copy_file_range and not (os.path.exists(dst) and os.path.samefile(src, dst)):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            # Some filesystems (eg. procfs and some FUSE filesystems) report zero bytes copied rather than
+            # raising an error. In that case the copy is incomplete, so fall through to `copyfile`.
+            if remaining <= 0:
+                return
+        except OSError:
+            # eg. Not supported by the filesystem(s) or kernel. Any partial copy is overwritten below.
+            pass
+
+    copyfile(src, dst)
+
+
 # abstract class
 # Done using the "old-school" method described here, without using the abs module
 # https://stackoverflow.com/a/25300153
 
 
 class BaseRunnerPlugin(object):
+    # Subclasses should also declare `__slots__` (which may be empty), otherwise their instances
+    # will still have a `__dict__`.
+    __slots__ = ('hum_event', 'cmf', '_projectfile_extension')
+
     def __init__(self, hum_event, ** kwargs):
         self.hum_event = hum_event
+        # The CrashMoveFolder constructor verifies the paths and raises a ValueError if any are missing
         self.cmf = CrashMoveFolder(self.hum_event.cmf_descriptor_path)
-
-        if not self.cmf.verify_paths():
-            raise ValueError("Cannot find paths and directories referenced by cmf {}".format(self.cmf.path))
+        # Cached value of `get_projectfile_extension()`. See `_get_cached_projectfile_extension()`
+        self._projectfile_extension = None
 
         if self.__class__ is BaseRunnerPlugin:
             raise NotImplementedError(
@@ -42,6 +160,56 @@ class BaseRunnerPlugin(object):
             'BaseRunnerPlugin is an abstract class and the `get_lyr_render_extension`'
             ' method cannot be called directly')
 
+    def _get_cached_projectfile_extension(self):
+        """
+        Returns the value of `get_projectfile_extension()`, which is a constant for any given plugin. The
+        value is looked up the first time this is called, rather than in the constructor, as plugins may
+        not be fully initialised until after `BaseRunnerPlugin.__init__` has returned.
+        """
+        if self._projectfile_extension is None:
+            self._projectfile_extension = self.get_projectfile_extension()
+
+        return self._projectfile_extension
+
+    def _iter_templates_by_regex(self, recipe):
+        """
+        A generator version of `_get_all_templates_by_regex`. Each matching template is yielded as soon as
+        it is found in the directory listing, so that the caller can start work on it (eg. via
+        `_map_templates_parallel`) before the rest of the listing has been checked.
+
+        @param recipe: A MapRecipe object.
+        @returns: A generator of the fully qualified filenames of the matching templates.
+        """
+        # Compile the regex and look up the extension once, rather than once per file
+        template_matches = _get_template_matcher(recipe.template)
+        projectfile_ext = self._get_cached_projectfile_extension()
+
+        # This is called for every file in the directory, so the log messages use lazy `%` formatting. The
+        # strings are only built if debug logging is actually enabled.
+        def _is_relevant_file(entry):
+            logger.debug('checking file "%s", against pattern "%s" and "%s"',
+                         entry.name, recipe.template, projectfile_ext)
+            # The cheapest tests come first, so that most irrelevant entries are rejected before the regex.
+            if has_extension(entry.name, projectfile_ext) and entry.is_file() and template_matches(entry.name):
+                logger.debug('file %s matched regex, full path "%s"', entry.name, entry.path)
+                return True
+            else:
+                return False
+
+        logger.debug('searching for map templates in; {}'.format(self.cmf.map_templates))
+        if not os.path.isdir(self.cmf.map_templates):
+            raise ValueError('Unable to locate map templates directory: {}'.format(self.cmf.map_templates))
+
+        # The cached listing already records the file type of each entry, so there is no need for a
+        # separate `stat` call per file. The directory is only re-read if it has changed since the last
+        # recipe was processed.
+        # The directory path is made absolute once, so that `entry.path` is already fully qualified. (The
+        # CrashMoveFolder has already resolved any symlinks in the directory path itself, so there is no
+        # need to call `os.path.realpath` on each template).
+        for entry in list_dir_cached(os.path.abspath(self.cmf.map_templates)):
+            if _is_relevant_file(entry):
+                yield entry.path
+
     def _get_all_templates_by_regex(self, recipe):
         """
         Gets the fully qualified filenames of map templates, which exist in `self.cmf.map_templates` whose
@@ -52,28 +220,43 @@ class BaseRunnerPlugin(object):
                  filename matches the regex `recipe.template` and that have the extention
                  `self.get_projectfile_extension()`
         """
-        def _is_relevant_file(f):
-            extension = os.path.splitext(f)[1]
-            logger.debug('checking file "{}", with extension "{}", against pattern "{}" and "{}"'.format(
-                f, extension, recipe.template, self.get_projectfile_extension()
-            ))
-            if re.search(recipe.template, f):
-                logger.debug('file {} matched regex'.format(f))
-                f_path = os.path.join(self.cmf.map_templates, f)
-                logger.debug('file {} joined with self.cmf.map_templates "{}"'.format(f, f_path))
-                return (os.path.isfile(f_path)) and (extension == self.get_projectfile_extension())
-            else:
-                return False
-
-        # TODO: This results in calling `os.path.join` twice for certain files
-        logger.debug('searching for map templates in; {}'.format(self.cmf.map_templates))
-        all_filenames = os.listdir(self.cmf.map_templates)
-        logger.debug('all available template files:\n\t{}'.format('\n\t'.join(all_filenames)))
-        relevant_filenames = [os.path.realpath(os.path.join(self.cmf.map_templates, fi))
-                              for fi in all_filenames if _is_relevant_file(fi)]
+        relevant_filenames = list(self._iter_templates_by_regex(recipe))
         logger.debug('possible template files:\n\t{}'.format('\n\t'.join(relevant_filenames)))
         return relevant_filenames
 
+    def _map_templates_parallel(self, func, templates, max_workers=8):
+        """
+        Applies `func` to each of the `templates` using a pool of threads. This is intended to help plugins
+        implement `get_aspect_ratios_of_templates`, where each template must be opened and inspected. Those
+        calls are dominated by file I/O, so opening several templates at once reduces the overall time.
+
+        Plugins should only use this if `func` is safe to call from multiple threads.
+
+        @param func: A function which accepts the path to a single template.
+        @param templates: An iterable of paths to templates. This may be a generator, such as
+                          `_iter_templates_by_regex`, in which case the templates are processed while the
+                          rest of the directory is still being read.
+        @param max_workers: The maximum number of threads to use.
+        @returns: A list of tuples, in the same order as `templates`. For each tuple the first element is the
+                  path to the template and the second element is the result of `func` for that template.
+        """
+        def _apply(template):
+            return template, func(template)
+
+        if isinstance(templates, (list, tuple)):
+            # There is no point starting more threads than there are templates, or any threads at all for a
+            # single template.
+            if len(templates) <= 1:
+                return [_apply(template) for template in templates]
+            max_workers = min(max_workers, len(templates))
+
+        pool = ThreadPool(max_workers)
+        try:
+            return list(pool.imap(_apply, templates))
+        finally:
+            pool.close()
+            pool.join()
+
     def _get_template_by_aspect_ratio(self, template_aspect_ratios, target_ar):
         """
         Selects the template which best matches the required aspect ratio.
@@ -88,34 +271,44 @@ class BaseRunnerPlugin(object):
         """
         logger.info('Selecting from available templates based on the most best matching aspect ratio')
 
+        # A single pass over the templates, which finds:
+        # * The most landscape and the most portrait templates.
+        # * The option with the smallest aspect ratio that is larger than target_ar.
+        # * The option with the largest aspect ratio that is smaller than target_ar.
+        most_landscape = most_portrait = larger_ar = smaller_ar = None
+        for templ in template_aspect_ratios:
+            templ_ar = templ[1]
+            if (most_landscape is None) or (templ_ar > most_landscape[1]):
+                most_landscape = templ
+            if (most_portrait is None) or (templ_ar < most_portrait[1]):
+                most_portrait = templ
+            if (templ_ar >= target_ar) and ((larger_ar is None) or (templ_ar < larger_ar[1])):
+                larger_ar = templ
+            if (templ_ar <= target_ar) and ((smaller_ar is None) or (templ_ar > smaller_ar[1])):
+                smaller_ar = templ
+
+        if most_landscape is None:
+            raise ValueError('Unable to select a template, as there are no templates to select from')
+
         # Target is more landscape than the most landscape template
-        most_landscape = max(template_aspect_ratios, key=itemgetter(1))
         if most_landscape[1] < target_ar:
             logger.info('Target area of interest is more landscape than the most landscape template')
             return most_landscape[0]
 
         # Target is more portrait than the most portrait template
-        most_portrait = min(template_aspect_ratios, key=itemgetter(1))
         if most_portrait[1] > target_ar:
             logger.info('Target area of interest is more portrait than the most portrait template')
             return most_portrait[0]
 
-        # The option with the smallest aspect ratio that is larger than target_ar
-        larger_ar = min(
-            [(templ_path, templ_ar) for templ_path, templ_ar in template_aspect_ratios if templ_ar >= target_ar],
-            key=itemgetter(1))
-        # The option with the largest aspect ratio that is smaller than target_ar
-        smaller_ar = max(
-            [(templ_path, templ_ar) for templ_path, templ_ar in template_aspect_ratios if templ_ar <= target_ar],
-            key=itemgetter(1))
-
         # Linear combination:
         # if (2*target_ar) > (larger_ar[1] + smaller_ar[1]):
         #     return larger_ar[0]
 
         # asmith: personally I think that this is the better option, but will go with the linear combination for now
-        # logarithmic combination
-        if (2*math.log(target_ar)) > (math.log(larger_ar[1]) + math.log(smaller_ar[1])):
+        # logarithmic combination. As the aspect ratios are all positive, comparing
+        #     2*log(target_ar) > log(larger_ar) + log(smaller_ar)
+        # is equivalent to comparing target_ar^2 > larger_ar * smaller_ar, which avoids the `log` calls.
+        if (target_ar * target_ar) > (larger_ar[1] * smaller_ar[1]):
             logger.info('Aspect ratio of the target area of interest lies between the aspect ratios of the'
                         ' available templates')
             return larger_ar[0]
@@ -130,6 +323,11 @@ class BaseRunnerPlugin(object):
         templates. The definition of "principal" is left to the plugin, though is typically the largest map
         frame.
 
+        If the aspect ratio of each template can be calculated independently (and safely from multiple
+        threads), then the implementation can use `_map_templates_parallel` to open the templates
+        concurrently, eg:
+            return self._map_templates_parallel(self._get_aspect_ratio_of_template, possible_templates)
+
         @param possible_templates: A list of paths to possible templates
         @returns: A list of tuples. For each tuple the first element is the path to the template. The second
                   element is the aspect ratio of the largest* map frame within that template.
@@ -142,7 +340,10 @@ class BaseRunnerPlugin(object):
 
     def _get_aspect_ratio_of_bounds(self, bounds):
         minx, miny, maxx, maxy = bounds
-        dx = (maxx - minx) % 360  # Accounts for the case where the bounds stradles the 180 meridian
+        dx = maxx - minx
+        if dx < 0:
+            # Accounts for the case where the bounds stradles the 180 meridian
+            dx += 360
         dy = maxy - miny
 
         return float(dx)/dy
@@ -169,6 +370,15 @@ class BaseRunnerPlugin(object):
         # use `recipe.template` as regex to locate one or more templates
         possible_templates = self._get_all_templates_by_regex(recipe)
 
+        if not possible_templates:
+            raise ValueError('Unable to locate any map templates matching the regex "{}" in {}'.format(
+                recipe.template, self.cmf.map_templates))
+
+        # If there is only one possible template, then there is no need to open it to find its aspect ratio
+        if len(possible_templates) == 1:
+            recipe.template_path = possible_templates[0]
+            return recipe
+
         # Select the template with the most appropriate aspect ratio
         possible_aspect_ratios = self.get_aspect_ratios_of_templates(possible_templates, recipe)
 
@@ -198,12 +408,32 @@ class BaseRunnerPlugin(object):
     # 2) This only checks the filename for the mxd - it doesn't check the values within the text element of
     # the map layout view (and hence the output metadata).
     def get_next_map_version_number(self, mapNumberDirectory, mapNumber, mapFileName):
+        # The existing map projects are named `<mapNumber>-v<two digit version>-<mapFileName>.mxd`. As only the
+        # version varies, the names are matched with plain string tests, and only the two version characters
+        # need to be checked with the (module level) regex.
+        prefix = '{}-v'.format(mapNumber)
+        suffix = '-{}.mxd'.format(mapFileName)
+        version_start = len(prefix)
+        version_end = version_start + 2
+        name_len = version_end + len(suffix)
+
+        # The directory is listed afresh every time (rather than via `list_dir_cached`), as it is where the new
+        # map projects are written, and a stale listing would give a version number which is already taken.
+        # As with `glob`, a missing directory is treated as empty.
+        try:
+            names = os.listdir(mapNumberDirectory)
+        except OSError:
+            names = []
+
+        # Use the highest existing version number, irrespective of the order the files are listed in.
         versionNumber = 0
-        files = glob.glob(mapNumberDirectory + os.sep + mapNumber+'-v[0-9][0-9]-' + mapFileName + '.mxd')
-        for file in files:
-            versionNumber = int(os.path.basename(file).replace(mapNumber + '-v', '').replace(('-' + mapFileName+'.mxd'), ''))  # noqa
-        versionNumber = versionNumber + 1
-        return versionNumber
+        for name in names:
+            if (len(name) == name_len) and name.startswith(prefix) and name.endswith(suffix):
+                version_str = name[version_start:version_end]
+                if _TWO_DIGITS_RE.match(version_str):
+                    versionNumber = max(versionNumber, int(version_str))
+
+        return versionNumber + 1
 
     # Is it possible to avoid the need to hardcode the naming convention for the output mxds? Eg could a
     # String.Template be specified within the Cookbook?
@@ -214,23 +444,22 @@ class BaseRunnerPlugin(object):
         # Create `mapNumberDirectory` for output
         output_dir = os.path.join(self.cmf.map_projects, recipe.mapnumber)
 
-        if not(os.path.isdir(output_dir)):
-            os.mkdir(output_dir)
+        _makedirs(output_dir)
 
         # Construct output MXD/QPRJ name
         logger.debug('About to create new map project file for product "{}"'.format(recipe.product))
-        output_map_base = slugify(recipe.product)
+        output_map_base = _slugify_cached(recipe.product)
         logger.debug('Set output name for new map project file to "{}"'.format(output_map_base))
         recipe.version_num = self.get_next_map_version_number(output_dir, recipe.mapnumber, output_map_base)
-        recipe.core_file_name = '{}-v{}-{}'.format(
-            recipe.mapnumber, str(recipe.version_num).zfill(2), output_map_base)
-        output_map_name = '{}{}'.format(recipe.core_file_name, self.get_projectfile_extension())
+        recipe.core_file_name = '{}-{}-{}'.format(
+            recipe.mapnumber, _get_version_str(recipe.version_num), output_map_base)
+        output_map_name = '{}{}'.format(recipe.core_file_name, self._get_cached_projectfile_extension())
         recipe.map_project_path = os.path.abspath(os.path.join(output_dir, output_map_name))
         logger.debug('Path for new map project file; {}'.format(recipe.map_project_path))
         logger.debug('Map Version number; {}'.format(recipe.version_num))
 
         # Copy `src_template` to `recipe.map_project_path`
-        copyfile(recipe.template_path, recipe.map_project_path)
+        _copy_file(recipe.template_path, recipe.map_project_path)
 
         return recipe
 
@@ -258,20 +487,11 @@ class BaseRunnerPlugin(object):
 
     def _create_export_dir(self, recipe):
         # Accumulate parameters for export XML
-        version_str = "v" + str(recipe.version_num).zfill(2)
+        version_str = _get_version_str(recipe.version_num)
         export_directory = os.path.abspath(
             os.path.join(self.cmf.export_dir, recipe.mapnumber, version_str))
         recipe.export_path = export_directory
-
-        try:
-            os.makedirs(export_directory)
-        except OSError as exc:  # Python >2.5
-            # Note 'errno.EEXIST' is not a typo. There should be two 'E's.
-            # https://docs.python.org/2/library/errno.html#errno.EEXIST
-            if exc.errno == errno.EEXIST and os.path.isdir(export_directory):
-                pass
-            else:
-                raise
+        _makedirs(export_directory)
 
         return recipe
 
@@ -322,9 +542,13 @@ class BaseRunnerPlugin(object):
         zip_fname = recipe.core_file_name+".zip"
         zip_fpath = os.path.join(recipe.export_path, zip_fname)
 
-        with ZipFile(zip_fpath, 'w') as zip_file:
+        # The compression is chosen per file. Text formats (eg. the XML metadata) are deflated, whereas
+        # already-compressed formats (eg. PNG, JPEG, PDF) are stored. `ZipFile.write` copies each file in
+        # chunks, so the whole file is never held in memory. `allowZip64` is explicit, as it defaults to
+        # False in Python 2.7, which would fail for very large exports.
+        with ZipFile(zip_fpath, 'w', compression=ZIP_DEFLATED, allowZip64=True) as zip_file:
             for fpath in recipe.zip_file_contents:
-                zip_file.write(fpath, os.path.basename(fpath))
+                zip_file.write(fpath, os.path.basename(fpath), compress_type=_get_zip_compress_type(fpath))
 
         logger.debug("Completed creation of zipfile {}".format(zip_fpath))
 
@@ -1,23 +1,205 @@
+import copy
+import json
 import logging
 import os
 # import shapefile
 import fiona
-import glob
 import re
 import hashlib
-import geopandas
+import itertools
+import mmap
 
 import jsonschema
 
 import mapactionpy_controller.data_schemas as data_schemas
 import mapactionpy_controller.state_serialization as state_serialization
 from mapactionpy_controller import _get_validator_for_config_schema
+from mapactionpy_controller._cache import BoundedCache
+from mapactionpy_controller._fs_cache import get_mtime, is_recently_modified, list_dir_cached
 import mapactionpy_controller.task_renderer as task_renderer
 
 
 logger = logging.getLogger(__name__)
 validate_against_layer_schema = _get_validator_for_config_schema('layer_properties-v0.2.schema')
 
+# Layer definitions which have already passed validation, serialised as JSON. The same layer definitions are
+# loaded by many recipes, and serialising one is much cheaper than validating it again.
+_valid_layer_defs = BoundedCache(1024)
+
+
+def _validate_layer_def(layer_def):
+    """
+    Equivalent to `validate_against_layer_schema(layer_def)`, except that a layer definition which is equal
+    to one that has already passed validation is not validated again.
+
+    @raises jsonschema.ValidationError: If `layer_def` is invalid.
+    """
+    try:
+        key = json.dumps(layer_def, sort_keys=True)
+    except (TypeError, ValueError):
+        # Not serialisable as JSON, so it cannot be cached (and is very likely to be invalid anyway).
+        validate_against_layer_schema(layer_def)
+        return
+
+    if key in _valid_layer_defs:
+        return
+
+    validate_against_layer_schema(layer_def)
+    _valid_layer_defs.set(key, True)
+
+
+# The layer regexes are matched against filenames using ASCII-only case folding, which is cheaper than
+# full Unicode case folding. This is also consistent with Python 2.7, where `str` patterns are always
+# ASCII-only (and `re.ASCII` does not exist).
+_LAYER_REGEX_FLAGS = re.IGNORECASE | getattr(re, 'ASCII', 0)
+
+
+# Compiled `reg_exp` values, keyed by the pattern. The same layers are used in many recipes.
+_layer_regex_cache = BoundedCache(256)
+
+
+def _create_layer_regex(reg_exp):
+    return re.compile(reg_exp, _LAYER_REGEX_FLAGS)
+
+
+def _compile_layer_regex(reg_exp):
+    return _layer_regex_cache.get_or_create(reg_exp, _create_layer_regex)
+
+
+# Files are hashed in blocks of this size, so that large datasets are never read into memory in one go
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _update_hash_from_file(hash, f_path):
+    with open(f_path, 'rb') as f:
+        # Files larger than a single block are memory mapped and hashed directly from the OS's page cache,
+        # which avoids copying each block into a new bytes object. (Empty files cannot be memory mapped.)
+        if os.fstat(f.fileno()).st_size > _HASH_BLOCK_SIZE:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError, OverflowError):
+                # eg the file is too large for the address space of a 32 bit process. Fall back to reading
+                # the file in blocks.
+                logger.debug('Unable to memory map "{}", reading it in blocks instead'.format(f_path))
+            else:
+                try:
+                    hash.update(mm)
+                finally:
+                    mm.close()
+                return
+
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            hash.update(block)
+
+
+# md5 checksums of sets of files, keyed by the path, modification time and size of each file. Many recipes
+# share the same layer files and datasets, so this avoids re-reading files which have not changed.
+_checksum_cache = BoundedCache(1024)
+
+
+def _calc_files_checksum(f_list):
+    """
+    Calculates the md5 checksum of the contents of all of the files in `f_list`, in the order given.
+
+    @param f_list: A list of paths to files.
+    @returns: The hex digest of the checksum.
+    """
+    f_stats = [os.stat(f_path) for f_path in f_list]
+    key = tuple((f_path, get_mtime(f_stat), f_stat.st_size) for f_path, f_stat in zip(f_list, f_stats))
+
+    checksum = _checksum_cache.get(key)
+    if checksum is not None:
+        return checksum
+
+    hash = hashlib.md5()
+    for f_path in f_list:
+        _update_hash_from_file(hash, f_path)
+    checksum = hash.hexdigest()
+
+    if not any(is_recently_modified(f_stat) for f_stat in f_stats):
+        _checksum_cache.set(key, checksum)
+
+    return checksum
+
+
+# Validators for the data schemas, keyed by the `id()` of the schema object. Each entry also holds the schema
+# itself, so that its `id()` cannot be reused by another object while the entry is cached.
+_data_schema_validator_cache = BoundedCache(256)
+
+
+def _validate_against_data_schema(instance, schema):
+    """
+    Equivalent to `jsonschema.validate(instance, schema)`, except that the schema is only checked, and its
+    validator created, once per schema object rather than on every call. The schema should not be modified
+    in place after it has been used.
+
+    @raises jsonschema.ValidationError: If the `instance` is invalid.
+    @raises jsonschema.SchemaError: If the `schema` itself is invalid.
+    """
+    cached = _data_schema_validator_cache.get(id(schema))
+    if cached and (cached[0] is schema):
+        validator = cached[1]
+    else:
+        validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+        validator = validator_cls(schema)
+        _data_schema_validator_cache.set(id(schema), (schema, validator))
+
+    error = jsonschema.exceptions.best_match(validator.iter_errors(instance))
+    if error is not None:
+        raise error
+
+
+# Parsed and checked data schema files, keyed by the path, modification time and size of the file. Many
+# layers share the same data schema file.
+_data_schema_cache = BoundedCache(256)
+
+
+def _load_data_schema(schema_file):
+    """
+    Parses a data schema file and checks that the schema itself is valid. The result for each file is cached,
+    so that the YAML is only parsed and checked once, however many layers use it.
+
+    @param schema_file: The absolute path to the data schema file.
+    @returns: The data schema. Each call returns a separate copy, so that the layers do not share one
+              mutable object.
+    @raises jsonschema.SchemaError: If the schema is invalid.
+    """
+    f_stat = os.stat(schema_file)
+    key = (schema_file, get_mtime(f_stat), f_stat.st_size)
+    if key in _data_schema_cache:
+        data_schema = _data_schema_cache.get(key)
+    else:
+        data_schema = data_schemas.parse_yaml(schema_file)
+        jsonschema.Draft7Validator.check_schema(data_schema)
+
+        if not is_recently_modified(f_stat):
+            _data_schema_cache.set(key, data_schema)
+
+    return copy.deepcopy(data_schema)
+
+
+def _read_schema_instance(data_source_path):
+    """
+    Reads the attributes of the first feature in a dataset, in the form used to validate the dataset against
+    its data schema. This is a dict of lists (one list per column), with additional `geometry_type` and
+    `crs` columns. Only the first feature is read, since only the schema is being checked. The features
+    are read directly with fiona, as there is no need for a DataFrame or shapely geometries.
+    """
+    with fiona.open(data_source_path) as src:
+        instance = dict((col, []) for col in src.schema['properties'])
+        instance.update({'geometry': [], 'geometry_type': [], 'crs': []})
+
+        for feature in itertools.islice(src, 1):
+            geometry = feature['geometry']
+            for col, value in feature['properties'].items():
+                instance[col].append(value)
+            instance['geometry'].append(geometry)
+            instance['geometry_type'].append(geometry['type'] if geometry else None)
+            instance['crs'].append(src.crs.get('init') or src.crs_wkt)
+
+    return instance
+
 
 class FixMissingGISDataTask(task_renderer.TaskReferralBase):
     _task_template_filename = 'missing-gis-file'
@@ -75,10 +257,13 @@ class FixSchemaErrorTask(task_renderer.TaskReferralBase):
             })
 
 
-class LabelClass:
+class LabelClass(object):
     """
     Enables selection of properties to support labels in a Layer
     """
+    # A recipe may hold many label classes, so `__slots__` is used rather than a `__dict__` per instance.
+    # The members are not frozen, as `expression` and `sql_query` are updated with event specific details.
+    __slots__ = ('class_name', 'expression', 'sql_query', 'show_class_labels')
 
     def __init__(self, row):
         self.class_name = row["class_name"]
@@ -87,7 +272,7 @@ class LabelClass:
         self.show_class_labels = row["show_class_labels"]
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return all(getattr(self, attr) == getattr(other, attr) for attr in LabelClass.__slots__)
 
     def __ne__(self, other):
         """Overrides the default implementation (unnecessary in Python 3)"""
@@ -106,7 +291,7 @@ class RecipeLayer:
         Arguments:
             row {dict} -- From the layerProperties.json file
         """
-        validate_against_layer_schema(layer_def)
+        _validate_layer_def(layer_def)
 
         # Required fields
         self.name = layer_def["name"]
@@ -160,12 +345,11 @@ class RecipeLayer:
     def _get_data_schema(self, layer_def, lyr_props):
         if 'data_schema' in layer_def:
             self.data_schema = layer_def['data_schema']
+            # check that the schema itself is valid.
+            jsonschema.Draft7Validator.check_schema(self.data_schema)
         else:
             schema_file = os.path.abspath(os.path.join(lyr_props.cmf.data_schemas, self.schema_definition))
-            self.data_schema = data_schemas.parse_yaml(schema_file)
-
-        # check that the schema itself is valid.
-        jsonschema.Draft7Validator.check_schema(self.data_schema)
+            self.data_schema = _load_data_schema(schema_file)
 
     def verify_layer_file_path(self):
         if not os.path.exists(self.layer_file_path):
@@ -176,7 +360,10 @@ class RecipeLayer:
         # This is being paraniod. This can only occur if there are more than one MapRecipe objects
         # being proceed simulatiously. There is isn't currently a use case where that would occur in
         # production code. This check is present just in case.
-        if self not in recipe.all_layers():
+        # In practice the layer is the very same object as the one in the recipe, so check for that first.
+        # That avoids comparing the full state of every other layer in the recipe with this one.
+        all_layers = recipe.all_layers()
+        if not (any(lyr is self for lyr in all_layers) or (self in all_layers)):
             error_msg = 'Attempting to update a layer ("{}") which is not part of the recipe'.format(
                 self.name)
             logging.error(error_msg)
@@ -199,14 +386,13 @@ class RecipeLayer:
 
             self._check_lyr_is_in_recipe(recipe)
 
-            found_files = []
+            # Compile the regex once, rather than once per file
+            lyr_regex = _compile_layer_regex(self.reg_exp)
 
             # Match filename *including extension* against regex
             # But only store the filename without extension
-            found_files.extend(
-                [(f_path, os.path.splitext(f_name)[0])
-                 for f_path, f_name in all_gis_files if re.search(self.reg_exp, f_name, re.IGNORECASE)]
-            )
+            found_files = [(f_path, os.path.splitext(f_name)[0])
+                           for f_path, f_name in all_gis_files if lyr_regex.search(f_name)]
 
             # Do checks and raise exceptions if required.
             self._check_found_files(found_files, cmf, recipe.hum_event)
@@ -250,12 +436,21 @@ class RecipeLayer:
     def _calc_data_source_checksum(self):
 
         def files_in_shp_file():
-            base_path = os.path.splitext(self.data_source_path)[0]
-            files = glob.glob('{}*'.format(base_path))
-            return [f_path for f_path in files if (os.path.isfile(f_path) and not f_path.endswith('.lock'))]
+            # All of the files in the same directory whose name starts with the shapefile's name (without its
+            # extension). A plain prefix test is used, rather than a glob, so that any glob metacharacters in
+            # the path are not misinterpreted.
+            dir_path, base_name = os.path.split(os.path.splitext(self.data_source_path)[0])
+            base_name = os.path.normcase(base_name)
+            return [entry.path for entry in list_dir_cached(dir_path)
+                    if (os.path.normcase(entry.name).startswith(base_name) and entry.is_file()
+                        and not entry.name.endswith('.lock'))]
 
         def files_in_dir():
-            return [os.path.join(f_path, f_name) for f_path, d_name, f_name in os.walk(self.data_source_path)]
+            # Every file within the directory (eg a file geodatabase), including those in sub-directories
+            f_paths = []
+            for dir_path, _, f_names in os.walk(self.data_source_path):
+                f_paths.extend(os.path.join(dir_path, f_name) for f_name in f_names if not f_name.endswith('.lock'))
+            return f_paths
 
         f_list = []
 
@@ -267,22 +462,15 @@ class RecipeLayer:
 
         f_list.sort()
 
-        hash = hashlib.md5()
-        for f_path in f_list:
-            with open(f_path, "rb") as data_file:
-                hash.update(data_file.read())
-
-        return hash.hexdigest()
+        return _calc_files_checksum(f_list)
 
     def _calc_layer_file_checksum(self):
         # if not os.path.isfile(self.layer_file_path):
         #     return None
 
-        hash = hashlib.md5()
         if os.path.isfile(self.layer_file_path):
-            with open(self.layer_file_path, "rb") as lf:
-                hash.update(lf.read())
-        return hash.hexdigest()
+            return _calc_files_checksum([self.layer_file_path])
+        return _calc_files_checksum([])
 
     # def get_schema_checker(self, runner):
     def check_data_against_schema(self, **kwargs):
@@ -301,22 +489,13 @@ class RecipeLayer:
             return recipe
 
         # Validate
+        instance_list = {}
         try:
             # Check for self consistancy before proceeding
             self._check_lyr_is_in_recipe(recipe)
 
-            # Only load one row since we are only checking the schema
-            gdf = geopandas.read_file(self.data_source_path, rows=1)
-            # Make columns needed for validation
-            gdf['geometry_type'] = gdf['geometry'].apply(lambda x: x.geom_type)
-            # print(gdf.crs)
-            if isinstance(gdf.crs, dict):
-                gdf['crs'] = gdf.crs['init']
-            else:
-                gdf['crs'] = gdf.crs
-
-            instance_list = gdf.to_dict('list')
-            jsonschema.validate(instance=instance_list, schema=self.data_schema)
+            instance_list = _read_schema_instance(self.data_source_path)
+            _validate_against_data_schema(instance_list, self.data_schema)
             logging.debug('Successfully validates jsonschema for gis data')
         # except jsonschema.ValidationError as jsve:
         except Exception as exp:
@@ -337,21 +516,22 @@ class RecipeLayer:
         @raises ValueError: If the `self.data_source_path` has not be set or is invalid.
         """
         if not self.data_source_path:
-            logger.info('Have no self.data_source_path')
+            logger.debug('Have no self.data_source_path')
             raise ValueError(
                 'Cannot calculate bounding box until relevant data has been found.'
                 ' Please use `get_data_finder()` first.')
 
-        logger.info('Has self.data_source_path')
+        logger.debug('Has self.data_source_path')
         recipe = kwargs['state']
         # print('recipe before in layer.calc_extent:')
         # print(recipe)
         self._check_lyr_is_in_recipe(recipe)
 
-        logger.info('passed _check_lyr_is_in_recipe')
-        sf = fiona.open(self.data_source_path)
-        self.extent = sf.bounds
-        self.crs = sf.crs['init']
+        logger.debug('passed _check_lyr_is_in_recipe')
+        # Only the dataset's header is needed, and the dataset is closed again afterwards
+        with fiona.open(self.data_source_path) as sf:
+            self.extent = sf.bounds
+            self.crs = sf.crs['init']
 
         return recipe
 
@@ -4,6 +4,7 @@ import chevron
 
 import mapactionpy_controller.name_convention as name_convention
 from mapactionpy_controller import TASK_TEMPLATES_DIR
+from mapactionpy_controller.crash_move_folder import CrashMoveFolder
 
 
 """
@@ -124,8 +125,13 @@ class FixFileInWrongDirTask(TaskReferralBase):
     _primary_key_template = 'gisdata : ->TBC.folder_name<-'
 
 
+# The public members of a CrashMoveFolder. It uses `__slots__` rather than a `__dict__`, and the `__slots__`
+# of a subclass would only list that subclass's own members, so they are listed explicitly here.
+_CMF_ATTRS = ('path', 'arcgis_version') + CrashMoveFolder._DIR_ATTRS + CrashMoveFolder._FILE_ATTRS
+
+
 def cmf_description_adapter(cmf):
-    return {'cmf': cmf.__dict__.copy()}
+    return {'cmf': dict((attr, getattr(cmf, attr)) for attr in _CMF_ATTRS)}
 
 
 def hum_event_adapter(hum_event):
@@ -0,0 +1,43 @@
+from mapactionpy_controller._cache import BoundedCache
+from unittest import TestCase
+
+
+class TestBoundedCache(TestCase):
+    def test_bounded_cache(self):
+        cache = BoundedCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(len(cache), 2)
+        self.assertIn('a', cache)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertIsNone(cache.get('c'))
+
+        # Replacing an existing item does not empty a full cache
+        cache.set('a', 3)
+        self.assertEqual((cache.get('a'), cache.get('b')), (3, 2))
+
+        # Adding a new item to a full cache empties it first
+        cache.set('c', 4)
+        self.assertEqual(len(cache), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('c'), 4)
+
+        cache.discard('c')
+        cache.discard('does-not-exist')
+        self.assertEqual(len(cache), 0)
+
+    def test_get_or_create(self):
+        cache = BoundedCache(8)
+        created = []
+
+        def create(key):
+            created.append(key)
+            return key.upper()
+
+        self.assertEqual(cache.get_or_create('abc', create), 'ABC')
+        self.assertEqual(cache.get_or_create('abc', create), 'ABC')
+        self.assertEqual(created, ['abc'])
+
+        cache.clear()
+        self.assertEqual(cache.get_or_create('abc', create), 'ABC')
+        self.assertEqual(created, ['abc', 'abc'])
@@ -0,0 +1,82 @@
+import mapactionpy_controller._fs_cache as fs_cache
+import os
+import shutil
+from unittest import TestCase
+import six
+import tempfile
+import time
+
+# works differently for python 2.7 and python 3.x
+if six.PY2:
+    import mock  # noqa: F401
+else:
+    from unittest import mock  # noqa: F401
+
+
+class TestFsCache(TestCase):
+    def setUp(self):
+        fs_cache.clear_list_dir_cache()
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'a.txt'), 'w') as f:
+            f.write('')
+        os.mkdir(os.path.join(self.tmp_dir, 'b'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        fs_cache.clear_list_dir_cache()
+
+    def _set_dir_mtime(self, seconds_ago):
+        mtime = time.time() - seconds_ago
+        os.utime(self.tmp_dir, (mtime, mtime))
+
+    def _get_names(self, listing):
+        return sorted(entry.name for entry in listing)
+
+    def test_list_dir_cached(self):
+        self._set_dir_mtime(60)
+        listing = fs_cache.list_dir_cached(self.tmp_dir)
+
+        self.assertEqual(self._get_names(listing), ['a.txt', 'b'])
+        entries = dict((entry.name, entry) for entry in listing)
+        self.assertTrue(entries['a.txt'].is_file())
+        self.assertFalse(entries['a.txt'].is_dir())
+        self.assertFalse(entries['b'].is_file())
+        self.assertTrue(entries['b'].is_dir())
+        self.assertEqual(entries['b'].path, os.path.join(self.tmp_dir, 'b'))
+
+        # An unchanged directory is not re-read
+        with mock.patch('mapactionpy_controller._fs_cache.scandir') as mock_scandir:
+            self.assertIs(fs_cache.list_dir_cached(self.tmp_dir), listing)
+            mock_scandir.assert_not_called()
+
+        # A changed directory is re-read
+        with open(os.path.join(self.tmp_dir, 'c.txt'), 'w') as f:
+            f.write('')
+        self._set_dir_mtime(30)
+        self.assertEqual(self._get_names(fs_cache.list_dir_cached(self.tmp_dir)), ['a.txt', 'b', 'c.txt'])
+
+    def test_list_dir_cached_recently_modified(self):
+        # The listing of a directory which has only just been modified is not cached
+        self._set_dir_mtime(0)
+        fs_cache.list_dir_cached(self.tmp_dir)
+
+        with open(os.path.join(self.tmp_dir, 'c.txt'), 'w') as f:
+            f.write('')
+        self._set_dir_mtime(0)
+        self.assertEqual(self._get_names(fs_cache.list_dir_cached(self.tmp_dir)), ['a.txt', 'b', 'c.txt'])
+
+    def test_list_dir_cached_missing_dir(self):
+        with self.assertRaises(OSError):
+            fs_cache.list_dir_cached(os.path.join(self.tmp_dir, 'does-not-exist'))
+
+    def test_list_dir_cached_does_not_check_file_types(self):
+        # The file type of each entry is only looked up if the caller asks for it
+        self._set_dir_mtime(60)
+        mock_entries = [mock.Mock(name='entry_a'), mock.Mock(name='entry_b')]
+        with mock.patch('mapactionpy_controller._fs_cache.scandir') as mock_scandir:
+            mock_scandir.return_value = iter(mock_entries)
+            self.assertEqual(fs_cache.list_dir_cached(self.tmp_dir), tuple(mock_entries))
+
+        for entry in mock_entries:
+            entry.is_file.assert_not_called()
+            entry.is_dir.assert_not_called()
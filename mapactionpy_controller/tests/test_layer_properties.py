@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 from mapactionpy_controller.layer_properties import LayerProperties
@@ -31,6 +33,30 @@ class TestLayerProperties(TestCase):
         # 4) test with invalid cmd file
         self.assertRaises(ValueError, LayerProperties, self.path_to_invalid_cmf_des, "test")
 
+    def test_get_lyr_rendering_names_as_set(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for f_name in ('a.lyr', 'b.lyr.bak', '.lyr', '..lyr', 'c.qml', 'd', 'e.tar.lyr'):
+                with open(os.path.join(tmp_dir, f_name), 'w') as f:
+                    f.write('')
+            # Directories are ignored, even if they have a matching name
+            os.mkdir(os.path.join(tmp_dir, 'f.lyr'))
+            os.mkdir(os.path.join(tmp_dir, 'g'))
+
+            test_cmf = CrashMoveFolder(self.path_to_valid_cmf_des)
+            test_cmf.layer_rendering = tmp_dir
+
+            test_cases = [
+                ('.lyr', set(['a', 'e.tar'])),
+                ('qml', set(['c'])),
+                ('', set(['d', '.lyr', '..lyr']))
+            ]
+            for extension, expect_result in test_cases:
+                test_lp = LayerProperties(test_cmf, extension, verify_on_creation=False)
+                self.assertEqual(test_lp._get_lyr_rendering_names_as_set(), expect_result)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_zero_length_file_extention(self):
         test_cmf = CrashMoveFolder(self.path_to_valid_cmf_des)
 
@@ -1,5 +1,7 @@
 import json
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 import fixtures
 from jsonschema import ValidationError
@@ -117,3 +119,56 @@ class TestMAController(TestCase):
         self.assertTrue(test_cmf.verify_paths())
         test_cmf.active_data = os.path.join(self.parent_dir, 'DOES-NOT-EXIST')
         self.assertFalse(test_cmf.verify_paths())
+
+    def test_cmf_path_verification_matches_os_path(self):
+        cmf_partial_fail = os.path.join(
+            self.parent_dir, 'tests', 'testfiles', 'fixture_cmf_description_one_file_and_one_dir_not_valid.json')
+
+        for cmf_path in (self.cmf_descriptor_path, cmf_partial_fail):
+            test_cmf = CrashMoveFolder(cmf_path, verify_on_creation=False)
+            actual_results = test_cmf._get_path_verification_as_dict()
+
+            for attr in CrashMoveFolder._DIR_ATTRS:
+                self.assertEqual(actual_results[attr], os.path.isdir(getattr(test_cmf, attr)))
+            for attr in CrashMoveFolder._FILE_ATTRS:
+                self.assertEqual(actual_results[attr], os.path.exists(getattr(test_cmf, attr)))
+
+    def test_cmf_path_verification_of_special_files(self):
+        if not hasattr(os, 'mkfifo'):
+            self.skipTest('Named pipes are not supported on this platform')
+
+        test_cmf = CrashMoveFolder(self.cmf_descriptor_path, verify_on_creation=False)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # Anything which `os.path.exists` accepts is a valid file path, eg a named pipe
+            test_cmf.layer_properties = os.path.join(tmp_dir, 'layer_properties.json')
+            os.mkfifo(test_cmf.layer_properties)
+            self.assertTrue(test_cmf._get_path_verification_as_dict()['layer_properties'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cmf_verify_paths_stops_at_first_failure(self):
+        test_cmf = CrashMoveFolder(self.cmf_descriptor_path, verify_on_creation=False)
+        # The first directory to be checked is in a parent directory which does not exist
+        test_cmf.active_data = os.path.join(self.parent_dir, 'DOES-NOT-EXIST', 'active_data')
+
+        with mock.patch('mapactionpy_controller.crash_move_folder.os.path.isdir') as mock_isdir:
+            mock_isdir.return_value = False
+            self.assertFalse(test_cmf.verify_paths())
+            # Only `active_data` is checked
+            self.assertEqual(mock_isdir.call_count, 1)
+
+    def test_cmf_verify_paths_is_cached(self):
+        test_cmf = CrashMoveFolder(self.cmf_descriptor_path, verify_on_creation=False)
+        self.assertTrue(test_cmf.verify_paths())
+
+        # Repeated calls, with unchanged paths, should not touch the filesystem again
+        with mock.patch('mapactionpy_controller.crash_move_folder.os.path.isdir') as mock_isdir:
+            self.assertTrue(test_cmf.verify_paths())
+            mock_isdir.assert_not_called()
+
+        # Unless a refresh is explicitly requested
+        with mock.patch('mapactionpy_controller.crash_move_folder.os.path.isdir') as mock_isdir:
+            mock_isdir.return_value = False
+            self.assertFalse(test_cmf.verify_paths(refresh=True))
+            mock_isdir.assert_called()
@@ -36,7 +36,6 @@ class TestNamingConvention(TestCase):
         cmf_descriptor_path = os.path.join(
             parent_dir, 'example', 'cmf_description.json')
         self.cmf = CrashMoveFolder(cmf_descriptor_path, verify_on_creation=False)
-        self.cmf.dnc_lookup_dir = os.path.join(parent_dir, 'example')
 
     def test_load_csv_files_for_data_name_validator(self):
         # Test with a valid csv table
@@ -0,0 +1,16 @@
+import os
+from unittest import TestCase
+
+from mapactionpy_controller._path_utils import has_extension
+
+
+class TestPathUtils(TestCase):
+
+    def test_has_extension(self):
+        names = ['a.lyr', 'a.LYR', 'a.lyr.bak', 'a.tar.lyr', '.lyr', '..lyr', '...lyr', '.a.lyr', 'a..lyr',
+                 'a.', 'a', '.a', '..a', '', 'lyr']
+        exts = ['.lyr', '.bak', '', '.', 'lyr', '.tar.lyr']
+        for name in names:
+            for ext in exts:
+                self.assertEqual(
+                    has_extension(name, ext), os.path.splitext(name)[1] == ext, (name, ext))
@@ -1,13 +1,18 @@
 from mapactionpy_controller.plugin_base import BaseRunnerPlugin
+import mapactionpy_controller.plugin_base as plugin_base
 from mapactionpy_controller.event import Event
 from mapactionpy_controller.crash_move_folder import CrashMoveFolder
 from mapactionpy_controller.layer_properties import LayerProperties
 from mapactionpy_controller.map_recipe import MapRecipe
 import fixtures
 import os
+import re
+import shutil
 from unittest import TestCase, skip
 import six
 import sys
+import tempfile
+import zipfile
 
 # works differently for python 2.7 and python 3.x
 if six.PY2:
@@ -42,6 +47,20 @@ class DummyRunner(BaseRunnerPlugin):
         return kwargs['state']
 
 
+class DummyDirEntry(object):
+    """
+    Minimal stand-in for the `DirEntry` objects returned by `scandir`
+    """
+
+    def __init__(self, dir_path, name, is_file=True):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._is_file = is_file
+
+    def is_file(self, follow_symlinks=True):
+        return self._is_file
+
+
 class TestPluginBase(TestCase):
     def setUp(self):
         self.parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -64,25 +83,129 @@ class TestPluginBase(TestCase):
         self.dummy_runner.cmf.map_templates = dummy_map_templates
 
         available_templates = [
-            'one-two-three.dummy_project_file',
-            'one-two-three.txt',
-            'abcde.dummy_project_file',
-            'abcde.txt'
+            DummyDirEntry(dummy_map_templates, 'one-two-three.dummy_project_file'),
+            DummyDirEntry(dummy_map_templates, 'one-two-three.txt'),
+            DummyDirEntry(dummy_map_templates, 'abcde.dummy_project_file'),
+            DummyDirEntry(dummy_map_templates, 'abcde.txt'),
+            DummyDirEntry(dummy_map_templates, 'abcde-dir.dummy_project_file', is_file=False),
+            # A name which is only the extension has no extension, according to `os.path.splitext`
+            DummyDirEntry(dummy_map_templates, '.dummy_project_file')
         ]
 
         expect_result = [
             '{}abcde.dummy_project_file'.format(dummy_map_templates)
         ]
 
-        with mock.patch('mapactionpy_controller.plugin_base.os.listdir') as mock_listdir:
-            with mock.patch('mapactionpy_controller.plugin_base.os.path.isfile') as mock_isfile:
-                mock_listdir.return_value = available_templates
-                mock_isfile.return_value = True
+        with mock.patch('mapactionpy_controller.plugin_base.list_dir_cached') as mock_list_dir:
+            with mock.patch('mapactionpy_controller.plugin_base.os.path.isdir') as mock_isdir:
+                mock_list_dir.return_value = tuple(available_templates)
+                mock_isdir.return_value = True
 
                 actual_result = self.dummy_runner._get_all_templates_by_regex(recipe)
 
         self.assertEqual(actual_result, expect_result)
 
+        # As in `os.path.splitext`, leading dots are not the start of an extension
+        recipe.template = r'^\.'
+        dotted_templates = [
+            DummyDirEntry(dummy_map_templates, '.dummy_project_file'),
+            DummyDirEntry(dummy_map_templates, '..dummy_project_file'),
+            DummyDirEntry(dummy_map_templates, '.x.dummy_project_file')
+        ]
+        with mock.patch('mapactionpy_controller.plugin_base.list_dir_cached') as mock_list_dir:
+            with mock.patch('mapactionpy_controller.plugin_base.os.path.isdir') as mock_isdir:
+                mock_list_dir.return_value = tuple(dotted_templates)
+                mock_isdir.return_value = True
+
+                actual_result = self.dummy_runner._get_all_templates_by_regex(recipe)
+
+        self.assertEqual(actual_result, ['{}.x.dummy_project_file'.format(dummy_map_templates)])
+
+        # A plugin whose project files have no extension only matches files without an extension
+        recipe.template = ''
+        available_templates.extend([
+            DummyDirEntry(dummy_map_templates, 'abcde'),
+            DummyDirEntry(dummy_map_templates, '.abcde')
+        ])
+        with mock.patch('mapactionpy_controller.plugin_base.list_dir_cached') as mock_list_dir:
+            with mock.patch('mapactionpy_controller.plugin_base.os.path.isdir') as mock_isdir:
+                with mock.patch.object(self.dummy_runner, '_projectfile_extension', ''):
+                    mock_list_dir.return_value = tuple(available_templates)
+                    mock_isdir.return_value = True
+
+                    actual_result = self.dummy_runner._get_all_templates_by_regex(recipe)
+
+        self.assertEqual(actual_result, [
+            '{}.dummy_project_file'.format(dummy_map_templates),
+            '{}abcde'.format(dummy_map_templates),
+            '{}.abcde'.format(dummy_map_templates)
+        ])
+        recipe.template = 'abcde'
+
+        # A missing map templates directory is reported clearly
+        with mock.patch('mapactionpy_controller.plugin_base.os.path.isdir') as mock_isdir:
+            mock_isdir.return_value = False
+            with self.assertRaises(ValueError):
+                self.dummy_runner._get_all_templates_by_regex(recipe)
+
+    def test_get_template_matcher(self):
+        filenames = ['arcgis_10_6_reference_landscape_bottom.mxd', 'arcgis_10_6_reference_portrait_bottom.mxd',
+                     'arcgis_10_6_thematic_landscape.mxd', 'reference.mxd', 'abc(d).mxd', '']
+        patterns = ['reference', 'reference_landscape', 'thematic', 'xyz', '', r'^reference', r'reference_.*_bottom',
+                    r'landscape\.mxd$', r'abc\(d\)', '(?i)REFERENCE', 'thematic|portrait', r'_\d+_']
+
+        for pattern in patterns:
+            matcher = plugin_base._get_template_matcher(pattern)
+            # The same matcher is reused for the same pattern
+            self.assertIs(plugin_base._get_template_matcher(pattern), matcher)
+
+            for f_name in filenames:
+                self.assertEqual(bool(matcher(f_name)), bool(re.search(pattern, f_name)),
+                                 'pattern="{}", filename="{}"'.format(pattern, f_name))
+
+    def test_slugify_cached(self):
+        products = ['Country Overview with Admin 1 Boundaries & P-Codes', u'Aper\xe7u du pays', 'abc']
+
+        plugin_base._slug_cache.clear()
+        for product in products:
+            expect_result = plugin_base.slugify(product)
+            with mock.patch('mapactionpy_controller.plugin_base.slugify') as mock_slugify:
+                mock_slugify.return_value = expect_result
+                for i in range(3):
+                    self.assertEqual(plugin_base._slugify_cached(product), expect_result)
+                mock_slugify.assert_called_once_with(product)
+
+    def test_get_cached_projectfile_extension(self):
+        with mock.patch.object(DummyRunner, 'get_projectfile_extension') as mock_get_ext:
+            mock_get_ext.return_value = '.dummy_project_file'
+            runner = DummyRunner(Event(self.path_to_event_des))
+
+            for i in range(3):
+                self.assertEqual(runner._get_cached_projectfile_extension(), '.dummy_project_file')
+
+            mock_get_ext.assert_called_once()
+
+    def test_map_templates_parallel(self):
+        templates = ['template_{}'.format(i) for i in range(20)]
+        expect_result = [(t, len(t)) for t in templates]
+
+        # Results are returned in the same order as the input, for both lists and generators
+        self.assertEqual(self.dummy_runner._map_templates_parallel(len, templates), expect_result)
+        self.assertEqual(self.dummy_runner._map_templates_parallel(len, (t for t in templates)), expect_result)
+        self.assertEqual(self.dummy_runner._map_templates_parallel(len, []), [])
+
+        # A single template is processed without starting a thread pool
+        with mock.patch('mapactionpy_controller.plugin_base.ThreadPool') as mock_pool:
+            self.assertEqual(self.dummy_runner._map_templates_parallel(len, ['abc']), [('abc', 3)])
+            mock_pool.assert_not_called()
+
+        # Exceptions raised by the function are passed back to the caller
+        def _raise_error(template):
+            raise ValueError(template)
+
+        with self.assertRaises(ValueError):
+            self.dummy_runner._map_templates_parallel(_raise_error, templates)
+
     def test_get_template_by_aspect_ratio(self):
         template_aspect_ratios = [
             ('one',   1.1),
@@ -134,6 +257,10 @@ class TestPluginBase(TestCase):
             # print('expect_result={}, actual_result={}'.format(expect_result, actual_result))
             self.assertEqual(expect_result, actual_result)
 
+        # No templates to select from
+        with self.assertRaises(ValueError):
+            self.dummy_runner._get_template_by_aspect_ratio([], 1.0)
+
     def test_get_templates(self):
 
         # Case 1
@@ -168,17 +295,96 @@ class TestPluginBase(TestCase):
             ('one', None)
         ]
 
-        for expected_result, extent in test_extents:
-            print(expected_result, extent)
+        with mock.patch.object(DummyRunner, '_get_all_templates_by_regex') as mock_get_all_templates:
+            mock_get_all_templates.return_value = ['one', 'two']
+            for expected_result, extent in test_extents:
+                print(expected_result, extent)
+                test_recipe = MapRecipe(fixtures.recipe_test_for_search_for_shapefiles, self.lyr_props)
+                test_recipe.map_frames[0].extent = extent
+                # mf.extent = extent
+                actual_recipe = self.dummy_runner.get_templates(state=test_recipe)
+                self.assertEquals(expected_result, actual_recipe.template_path)
+
+        # Case 5
+        # Only one template matches the regex, so its aspect ratio is not required
+        with mock.patch.object(DummyRunner, '_get_all_templates_by_regex') as mock_get_all_templates:
+            with mock.patch.object(DummyRunner, 'get_aspect_ratios_of_templates') as mock_get_ars:
+                mock_get_all_templates.return_value = ['only_one']
+                test_recipe = MapRecipe(fixtures.recipe_test_for_search_for_shapefiles, self.lyr_props)
+                test_recipe.map_frames[0].extent = (1, 1, 9, 5)
+                actual_recipe = self.dummy_runner.get_templates(state=test_recipe)
+                self.assertEqual('only_one', actual_recipe.template_path)
+                mock_get_ars.assert_not_called()
+
+        # Case 6
+        # No templates match the regex
+        with mock.patch.object(DummyRunner, '_get_all_templates_by_regex') as mock_get_all_templates:
+            mock_get_all_templates.return_value = []
             test_recipe = MapRecipe(fixtures.recipe_test_for_search_for_shapefiles, self.lyr_props)
-            test_recipe.map_frames[0].extent = extent
-            # mf.extent = extent
-            actual_recipe = self.dummy_runner.get_templates(state=test_recipe)
-            self.assertEquals(expected_result, actual_recipe.template_path)
+            with self.assertRaises(ValueError):
+                self.dummy_runner.get_templates(state=test_recipe)
+
+    def test_get_aspect_ratio_of_bounds(self):
+        test_cases = [
+            ((1, 1, 5, 5), 1.0),
+            ((1, 1, 9, 5), 2.0),
+            ((-10.5, 20.0, -8.0, 30.0), 0.25),
+            # Bounds which stradle the 180 meridian
+            ((170, -20, -170, 0), 1.0),
+            # Bounds which cover the whole world
+            ((-180, -90, 180, 90), 2.0)
+        ]
+
+        for bounds, expect_result in test_cases:
+            self.assertAlmostEqual(self.dummy_runner._get_aspect_ratio_of_bounds(bounds), expect_result)
+
+    def test_get_version_str(self):
+        self.assertEqual(plugin_base._get_version_str(1), 'v01')
+        self.assertEqual(plugin_base._get_version_str(12), 'v12')
+        self.assertEqual(plugin_base._get_version_str(123), 'v123')
 
-    @skip('Not ready yet')
     def test_get_next_map_version_number(self):
-        self.fail()
+        dummy_map_projects = '/xyz/MA001'
+
+        test_cases = [
+            # No existing versions
+            ([], 1),
+            # Files which do not match the map number, the product name or the version pattern are ignored
+            (['MA002-v04-country-overview.mxd',
+              'MA001-v04-country-overview-a3.mxd',
+              'MA001-v4-country-overview.mxd',
+              'MA001-v123-country-overview.mxd',
+              'MA001-vAB-country-overview.mxd',
+              'MA001-v04-country-overview.qgs'], 1),
+            # The highest version is used, irrespective of the order in which the files are listed
+            (['MA001-v05-country-overview.mxd',
+              'MA001-v03-country-overview.mxd'], 6),
+            (['MA001-v01-country-overview.mxd',
+              'MA001-v12-country-overview.mxd',
+              'MA001-v02-country-overview.mxd'], 13)
+        ]
+
+        for available_files, expect_result in test_cases:
+            with mock.patch('mapactionpy_controller.plugin_base.os.listdir') as mock_listdir:
+                mock_listdir.return_value = available_files
+                actual_result = self.dummy_runner.get_next_map_version_number(
+                    dummy_map_projects, 'MA001', 'country-overview')
+
+            self.assertEqual(actual_result, expect_result)
+
+        # A directory which does not exist yet has no existing versions
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(self.dummy_runner.get_next_map_version_number(
+                os.path.join(tmp_dir, 'MA001'), 'MA001', 'country-overview'), 1)
+
+            # A new version is seen immediately, as the directory listing is not cached
+            for version_str, expect_result in [('01', 2), ('02', 3)]:
+                open(os.path.join(tmp_dir, 'MA001-v{}-country-overview.mxd'.format(version_str)), 'w').close()
+                self.assertEqual(self.dummy_runner.get_next_map_version_number(
+                    tmp_dir, 'MA001', 'country-overview'), expect_result)
+        finally:
+            shutil.rmtree(tmp_dir)
 
     @skip('Not ready yet')
     def test_create_output_map_project(self):
@@ -211,6 +417,71 @@ class TestPluginBase(TestCase):
 
                 self.assertEqual(actual_result.export_path, expect_result)
 
+    def test_makedirs(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            nested_dir = os.path.join(tmp_dir, 'MA1234', 'v01')
+            plugin_base._makedirs(nested_dir)
+            self.assertTrue(os.path.isdir(nested_dir))
+
+            # Calling again for an existing directory is not an error
+            plugin_base._makedirs(nested_dir)
+            self.assertTrue(os.path.isdir(nested_dir))
+
+            # A file in the way is still an error
+            file_in_the_way = os.path.join(tmp_dir, 'a_file')
+            with open(file_in_the_way, 'w') as f:
+                f.write('not a directory')
+
+            with self.assertRaises(OSError):
+                plugin_base._makedirs(file_in_the_way)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_copy_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp_dir, 'template.dummy_project_file')
+            # Large enough that `copy_file_range` may need more than one call
+            src_contents = os.urandom(3 * 1024 * 1024 + 17)
+            with open(src, 'wb') as f:
+                f.write(src_contents)
+
+            def _check_copy(dst):
+                plugin_base._copy_file(src, dst)
+                with open(dst, 'rb') as f:
+                    self.assertEqual(f.read(), src_contents)
+
+            _check_copy(os.path.join(tmp_dir, 'fast_path.dummy_project_file'))
+
+            # Fallback, for the case where `copy_file_range` is unavailable or unsupported
+            with mock.patch('mapactionpy_controller.plugin_base.os.copy_file_range', create=True) as mock_cfr:
+                mock_cfr.side_effect = OSError('Not supported')
+                _check_copy(os.path.join(tmp_dir, 'fallback.dummy_project_file'))
+
+            # Fallback, for the case where `copy_file_range` reports that nothing was copied
+            with mock.patch('mapactionpy_controller.plugin_base.os.copy_file_range', create=True) as mock_cfr:
+                mock_cfr.return_value = 0
+                _check_copy(os.path.join(tmp_dir, 'zero_copied.dummy_project_file'))
+
+            # A missing source file is still an error
+            with self.assertRaises((IOError, OSError)):
+                plugin_base._copy_file(os.path.join(tmp_dir, 'does-not-exist'), os.path.join(tmp_dir, 'dst'))
+
+            # Copying a file onto itself is an error, and leaves the file intact
+            same_paths = [src]
+            if hasattr(os, 'symlink') and not sys.platform.startswith('win'):
+                link = os.path.join(tmp_dir, 'link.dummy_project_file')
+                os.symlink(src, link)
+                same_paths.append(link)
+            for dst in same_paths:
+                with self.assertRaises(shutil.Error):
+                    plugin_base._copy_file(src, dst)
+                with open(src, 'rb') as f:
+                    self.assertEqual(f.read(), src_contents)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_check_paths_for_zip_contents(self):
         test_recipe = MapRecipe(fixtures.recipe_test_for_search_for_shapefiles, self.lyr_props)
 
@@ -261,6 +532,45 @@ class TestPluginBase(TestCase):
         self.dummy_runner._check_paths_for_zip_contents(test_recipe)
         self.assertTrue(True)
 
-    @skip('Not ready yet')
+    def test_get_zip_compress_type(self):
+        test_cases = [
+            ('/xyz/MA001-v01-country-overview.xml', zipfile.ZIP_DEFLATED),
+            ('/xyz/MA001-v01-country-overview.emf', zipfile.ZIP_DEFLATED),
+            ('/xyz/MA001-v01-country-overview', zipfile.ZIP_DEFLATED),
+            ('/xyz/MA001-v01-country-overview.pdf', zipfile.ZIP_STORED),
+            ('/xyz/MA001-v01-country-overview-thumbnail.png', zipfile.ZIP_STORED),
+            ('/xyz/MA001-v01-country-overview-300dpi.JPG', zipfile.ZIP_STORED)
+        ]
+
+        for fpath, expect_result in test_cases:
+            self.assertEqual(plugin_base._get_zip_compress_type(fpath), expect_result)
+
     def test_zip_exported_files(self):
-        self.fail()
+        test_recipe = MapRecipe(fixtures.recipe_test_for_search_for_shapefiles, self.lyr_props)
+        test_recipe.core_file_name = 'MA001-v01-test-zip'
+        test_recipe.zip_file_contents = [
+            self.path_to_valid_cmf_des,
+            self.path_to_event_des
+        ]
+
+        test_recipe.export_path = tempfile.mkdtemp()
+        try:
+            self.dummy_runner.zip_exported_files(test_recipe)
+
+            zip_fpath = os.path.join(test_recipe.export_path, 'MA001-v01-test-zip.zip')
+            with zipfile.ZipFile(zip_fpath) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                self.assertEqual(
+                    sorted(zip_file.namelist()),
+                    ['cmf_description_flat_test.json', 'event_description.json'])
+
+                # The contents of the zip file match the original files
+                for fpath in test_recipe.zip_file_contents:
+                    with open(fpath, 'rb') as orig_file:
+                        self.assertEqual(zip_file.read(os.path.basename(fpath)), orig_file.read())
+
+                # Text files are compressed
+                for zip_info in zip_file.infolist():
+                    self.assertEqual(zip_info.compress_type, zipfile.ZIP_DEFLATED)
+        finally:
+            shutil.rmtree(test_recipe.export_path)
@@ -1,9 +1,16 @@
 
 from unittest import TestCase
+import copy
+import datetime
 import fixtures
+import hashlib
+import json
 import jsonschema
 import os
+import shutil
 import six
+import tempfile
+import time
 import yaml
 
 from mapactionpy_controller.layer_properties import LayerProperties
@@ -73,6 +80,8 @@ properties:
 
         # Two cases where data schema is valid yaml
         for test_schema in [null_schema, passing_schema]:
+            # The parsed schema files are cached, so clear the cache for each mocked value
+            recipe_layer._data_schema_cache.clear()
             with mock.patch('mapactionpy_controller.data_schemas.yaml.safe_load') as mock_safe_load:
                 mock_safe_load.return_value = test_schema
                 test_lp = LayerProperties(cmf, ".lyr", verify_on_creation=False)
@@ -80,7 +89,18 @@ properties:
                 MapRecipe(fixtures.recipe_with_positive_iso3_code, test_lp)
                 self.assertTrue(True, 'validated jsonschema')
 
+        # The schema files are only parsed once
+        recipe_layer._data_schema_cache.clear()
+        with mock.patch('mapactionpy_controller.data_schemas.yaml.safe_load') as mock_safe_load:
+            mock_safe_load.return_value = passing_schema
+            MapRecipe(fixtures.recipe_with_positive_iso3_code, test_lp)
+            call_count = mock_safe_load.call_count
+            self.assertGreater(call_count, 0)
+            MapRecipe(fixtures.recipe_with_positive_iso3_code, test_lp)
+            self.assertEqual(mock_safe_load.call_count, call_count)
+
         # case where data schema file itself malformed somehow
+        recipe_layer._data_schema_cache.clear()
         with mock.patch('mapactionpy_controller.data_schemas.yaml.safe_load') as mock_safe_load:
             mock_safe_load.return_value = failing_schema
 
@@ -90,6 +110,7 @@ properties:
                 fixtures.recipe_with_positive_iso3_code,
                 test_lp
             )
+        recipe_layer._data_schema_cache.clear()
 
     def test_verify_layer_file_path(self):
         """
@@ -119,6 +140,16 @@ properties:
         # This should pass without error
         test_lyr._check_lyr_is_in_recipe(recipe_A)
 
+        # The layer is found without comparing its state to the other layers in the recipe
+        recipe_A.map_frames[0].layers.insert(0, recipe_B.all_layers()[0])
+        with mock.patch.object(recipe_layer.RecipeLayer, '__eq__') as mock_eq:
+            test_lyr._check_lyr_is_in_recipe(recipe_A)
+            mock_eq.assert_not_called()
+
+        # An equal copy of a layer is still accepted
+        copy_lyr = copy.deepcopy(test_lyr)
+        copy_lyr._check_lyr_is_in_recipe(recipe_A)
+
         # This should fail because test_lyr is not from recipe_B
         fail_msg = 'which is not part of the recipe'
         with self.assertRaises(ValueError) as arcm:
@@ -155,6 +186,194 @@ properties:
         expected_hash_of_shp_file = '1acb212b47c8ccb3006ae9b4c5f1cfc0'
         self.assertEqual(actual_has_of_shp_file, expected_hash_of_shp_file)
 
+        # The result does not depend on the size of the blocks that the files are read in
+        # or whether the files are memory mapped
+        recipe_layer._checksum_cache.clear()
+        with mock.patch('mapactionpy_controller.recipe_layer._HASH_BLOCK_SIZE', 7):
+            with mock.patch('mapactionpy_controller.recipe_layer.mmap.mmap', wraps=recipe_layer.mmap.mmap) as mock_mmap:
+                self.assertEqual(test_lyr._calc_data_source_checksum(), expected_hash_of_shp_file)
+                self.assertTrue(mock_mmap.called)
+
+            recipe_layer._checksum_cache.clear()
+            with mock.patch('mapactionpy_controller.recipe_layer.mmap.mmap', side_effect=EnvironmentError):
+                self.assertEqual(test_lyr._calc_data_source_checksum(), expected_hash_of_shp_file)
+
+        # Glob metacharacters in the path do not affect which files are included
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            shp_dir = os.path.join(tmp_dir, 'data[1]')
+            os.mkdir(shp_dir)
+            src_dir, base_name = os.path.split(os.path.splitext(test_lyr.data_source_path)[0])
+            for f_name in os.listdir(src_dir):
+                if f_name.startswith(base_name):
+                    shutil.copy(os.path.join(src_dir, f_name), shp_dir)
+
+            test_lyr.data_source_path = os.path.join(shp_dir, 'lbn_admn_ad0_py_s1_pp_cdr.shp')
+            self.assertEqual(test_lyr._calc_data_source_checksum(), expected_hash_of_shp_file)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_calc_data_source_checksum_of_dir(self):
+        test_recipe = MapRecipe(fixtures.recipe_with_layer_name_only, self.lyr_props)
+        test_lyr = test_recipe.all_layers().pop()
+
+        # A dataset which is a directory (eg a file geodatabase), including a sub-directory and a lock file
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gdb_dir = os.path.join(tmp_dir, 'lbn_data.gdb')
+            os.makedirs(os.path.join(gdb_dir, 'sub'))
+            for f_name, content in [('a.gdbtable', b'abc'), (os.path.join('sub', 'b.gdbtable'), b'def'),
+                                    ('c.sr.lock', b'ghi')]:
+                with open(os.path.join(gdb_dir, f_name), 'wb') as f:
+                    f.write(content)
+
+            test_lyr.data_source_path = gdb_dir
+            self.assertEqual(test_lyr._calc_data_source_checksum(), hashlib.md5(b'abcdef').hexdigest())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_compile_layer_regex(self):
+        lyr_regex = recipe_layer._compile_layer_regex(r'^[a-z]{3}_admn_ad0_py_(.*?)_(.*?)_([phm][phm])(.*?).shp$')
+
+        # Case insensitive
+        self.assertTrue(lyr_regex.search('lbn_admn_ad0_py_s0_unocha_pp.shp'))
+        self.assertTrue(lyr_regex.search('LBN_admn_ad0_py_s0_unocha_PP.SHP'))
+        self.assertFalse(lyr_regex.search('lbn_admn_ad1_py_s0_unocha_pp.shp'))
+        self.assertFalse(lyr_regex.search('lbn_admn_ad0_py_s0_unocha_pp.shp.xml'))
+        # Non-ASCII characters do not case-fold to ASCII letters (eg the Kelvin sign and 'k')
+        self.assertFalse(lyr_regex.search(u'\u212abn_admn_ad0_py_s0_unocha_pp.shp'))
+
+        # The same compiled pattern is reused
+        self.assertIs(recipe_layer._compile_layer_regex(lyr_regex.pattern), lyr_regex)
+
+    def test_validate_layer_def(self):
+        recipe_layer._valid_layer_defs.clear()
+        recipe_def = json.loads(fixtures.recipe_with_layer_details_embedded)
+        layer_def = recipe_def['map_frames'][0]['layers'][0]
+
+        with mock.patch('mapactionpy_controller.recipe_layer.validate_against_layer_schema',
+                        wraps=recipe_layer.validate_against_layer_schema) as mock_validate:
+            # An equal layer definition is only validated once
+            recipe_layer._validate_layer_def(layer_def)
+            recipe_layer._validate_layer_def(copy.deepcopy(layer_def))
+            self.assertEqual(mock_validate.call_count, 1)
+
+            # An invalid layer definition is validated (and rejected) every time
+            invalid_def = copy.deepcopy(layer_def)
+            del invalid_def['reg_exp']
+            for i in range(2):
+                with self.assertRaises(jsonschema.ValidationError):
+                    recipe_layer._validate_layer_def(invalid_def)
+            self.assertEqual(mock_validate.call_count, 3)
+
+        recipe_layer._valid_layer_defs.clear()
+
+    def test_label_class(self):
+        row = {'class_name': 'National Capital', 'expression': '[name]', 'sql_query': '', 'show_class_labels': True}
+        lbl_class = recipe_layer.LabelClass(row)
+
+        self.assertFalse(hasattr(lbl_class, '__dict__'))
+        self.assertEqual(lbl_class, recipe_layer.LabelClass(dict(row)))
+        self.assertEqual(lbl_class, copy.deepcopy(lbl_class))
+
+        # The members can still be updated with event specific details
+        lbl_class.sql_query = '("fclass" = \'national_capital\')'
+        self.assertNotEqual(lbl_class, recipe_layer.LabelClass(row))
+
+    def test_validate_against_data_schema(self):
+        schema = {'required': ['name_en'], 'properties': {'crs': {'items': {'const': 'epsg:4326'}}}}
+        test_cases = [
+            {'name_en': ['abc'], 'crs': ['epsg:4326']},
+            {'crs': ['epsg:4326']},
+            {'name_en': ['abc'], 'crs': ['epsg:3857']},
+            {'crs': ['epsg:3857']}
+        ]
+
+        for instance in test_cases:
+            try:
+                jsonschema.validate(instance, schema)
+                expected_error = None
+            except jsonschema.ValidationError as ve:
+                expected_error = ve.message
+
+            if expected_error is None:
+                recipe_layer._validate_against_data_schema(instance, schema)
+            else:
+                with self.assertRaises(jsonschema.ValidationError) as arcm:
+                    recipe_layer._validate_against_data_schema(instance, schema)
+                self.assertEqual(arcm.exception.message, expected_error)
+
+        # The validator is only created once for the same schema
+        recipe_layer._data_schema_validator_cache.clear()
+        schema = {'required': ['name_en']}
+        with mock.patch('jsonschema.validators.validator_for', wraps=jsonschema.validators.validator_for) as mock_vf:
+            recipe_layer._validate_against_data_schema({'name_en': []}, schema)
+            call_count = mock_vf.call_count
+            self.assertGreater(call_count, 0)
+            recipe_layer._validate_against_data_schema({'name_en': [1]}, schema)
+            self.assertEqual(mock_vf.call_count, call_count)
+
+        # Schemas which only look the same when serialised do not share a validator
+        date_schema = {'const': datetime.date(2020, 1, 1)}
+        str_schema = {'const': '2020-01-01'}
+        recipe_layer._validate_against_data_schema(datetime.date(2020, 1, 1), date_schema)
+        with self.assertRaises(jsonschema.ValidationError):
+            recipe_layer._validate_against_data_schema(datetime.date(2020, 1, 1), str_schema)
+
+        # An invalid schema is still an error
+        with self.assertRaises(jsonschema.SchemaError):
+            recipe_layer._validate_against_data_schema({}, {'required': 'name_en'})
+
+    def test_calc_files_checksum(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            f_path = os.path.join(tmp_dir, 'test.lyr')
+
+            def _write_file(contents, seconds_ago):
+                with open(f_path, 'wb') as f:
+                    f.write(contents)
+                mtime = time.time() - seconds_ago
+                os.utime(f_path, (mtime, mtime))
+
+            recipe_layer._checksum_cache.clear()
+            _write_file(b'abc', 60)
+            self.assertEqual(recipe_layer._calc_files_checksum([f_path]), hashlib.md5(b'abc').hexdigest())
+
+            # An unchanged file is not re-read
+            with mock.patch('mapactionpy_controller.recipe_layer._update_hash_from_file') as mock_update_hash:
+                self.assertEqual(recipe_layer._calc_files_checksum([f_path]), hashlib.md5(b'abc').hexdigest())
+                mock_update_hash.assert_not_called()
+
+            # A changed file is re-read
+            _write_file(b'abcdef', 30)
+            self.assertEqual(recipe_layer._calc_files_checksum([f_path]), hashlib.md5(b'abcdef').hexdigest())
+
+            # The checksum of a file which has only just been modified is not cached
+            _write_file(b'xyz', 0)
+            self.assertEqual(recipe_layer._calc_files_checksum([f_path]), hashlib.md5(b'xyz').hexdigest())
+            _write_file(b'uvw', 0)
+            self.assertEqual(recipe_layer._calc_files_checksum([f_path]), hashlib.md5(b'uvw').hexdigest())
+
+            # No files
+            self.assertEqual(recipe_layer._calc_files_checksum([]), hashlib.md5().hexdigest())
+        finally:
+            shutil.rmtree(tmp_dir)
+            recipe_layer._checksum_cache.clear()
+
+    def test_read_schema_instance(self):
+        shp_path = os.path.join(
+            self.parent_dir, 'tests', 'testfiles', 'test_shp_files', 'lbn_admn_ad0_py_s1_pp_cdr.shp')
+
+        instance = recipe_layer._read_schema_instance(shp_path)
+
+        # One value per column, from the first feature only
+        self.assertTrue(all(len(values) == 1 for values in instance.values()))
+        self.assertEqual(instance['admin0Name'], ['Lebanon'])
+        self.assertEqual(instance['admin0Pcod'], ['LB'])
+        self.assertEqual(instance['admin0AltN'], [None])
+        self.assertEqual(instance['geometry_type'], ['Polygon'])
+        self.assertEqual(instance['crs'], ['epsg:4326'])
+
     def test_get_schema_checker(self):
         test_recipe = MapRecipe(fixtures.recipe_with_layer_name_only, self.lyr_props)
 
@@ -266,7 +485,19 @@ properties:
             'lbn_admn_ad0_py_s1_pp_cdr.shp')
 
         # Get the extents shapefile and update the test_lyr object
-        test_lyr.calc_extent(state=test_recipe)
+        opened = []
+        real_open = recipe_layer.fiona.open
+
+        def open_and_record(*args, **kwargs):
+            opened.append(real_open(*args, **kwargs))
+            return opened[-1]
+
+        with mock.patch('mapactionpy_controller.recipe_layer.fiona.open', side_effect=open_and_record):
+            test_lyr.calc_extent(state=test_recipe)
+
+        # The dataset is closed afterwards
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
 
         expected_extent = [35.10348736558511, 33.054996785738204, 36.62291533501688, 34.69206915371]
         # expected_crs = (
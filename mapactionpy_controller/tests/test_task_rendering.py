@@ -98,6 +98,15 @@ class TestTaskRendering(TestCase):
         test_cmf = CrashMoveFolder(self.path_to_valid_cmf_des)
         test_cd = task_renderer.cmf_description_adapter(test_cmf)
         self.assertEqual(self.dir_to_valid_cmf_des, test_cd['cmf']['path'])
+        self.assertEqual(test_cmf.map_templates, test_cd['cmf']['map_templates'])
+        self.assertEqual(test_cmf.layer_properties, test_cd['cmf']['layer_properties'])
+
+        # All of the members are included for a subclass of CrashMoveFolder too
+        class SubCrashMoveFolder(CrashMoveFolder):
+            __slots__ = ('extra',)
+
+        test_sub_cd = task_renderer.cmf_description_adapter(SubCrashMoveFolder(self.path_to_valid_cmf_des))
+        self.assertEqual(test_sub_cd, test_cd)
 
     @skip('Not ready yet')
     def test_render_with_schema_error(self):
@@ -62,9 +62,6 @@ def can_import_geo_packages():
         # Test RTree
         from rtree import index  # noqa: F401
 
-        # Test geopandas
-        import geopandas  # noqa: F401
-
         return True
     except ImportError:
         return False
@@ -90,7 +87,8 @@ def _get_requires_list():
         # For debate whether this is useful 'pyreproj==1.0.1'
         requires.extend([
             'pyrsistent<=0.16.1',
-            'pycountry<=19.8.18'
+            'pycountry<=19.8.18',
+            'scandir'
         ])
     else:
         requires.extend([
@@ -117,8 +115,7 @@ def _get_requires_list():
             'pyproj',
             'Shapely',
             gdal_str,
-            'Rtree',
-            'geopandas'
+            'Rtree'
         ])
 
     return requires